@@ -1,122 +1,212 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request
 import pandas as pd
 import numpy as np
 import geopandas as gpd
+import pyogrio
+import hashlib
 import json
 from datetime import datetime
 import os
 import warnings
 from shapely.geometry import mapping
 
+try:
+    import pyarrow  # noqa: F401
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
 # Suppress warnings for cleaner output
 warnings.filterwarnings('ignore')
 
 app = Flask(__name__)
 
+# Data locations - override with environment variables instead of editing the code
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('SA_CRIME_DATA_DIR', os.path.join(BASE_DIR, 'data'))
+CACHE_DIR = os.environ.get('SA_CRIME_CACHE_DIR', os.path.join(DATA_DIR, '.cache'))
+CRIME_CSV = 'SouthAfricaCrimeStats_v2.csv'
+BOUNDS_FILE = os.environ.get('SA_CRIME_BOUNDS_FILE', 'Police_bounds.shp')
+POINTS_FILE = os.environ.get('SA_CRIME_POINTS_FILE', 'Police_points.shp')
+TARGET_CRS = 'EPSG:4326'
+# Africa Albers Equal Area Conic, used for area-weighted region overlap
+EQUAL_AREA_CRS = 'ESRI:102022'
+# Number of uploaded region sets kept in memory
+REGION_CACHE_SIZE = 32
+
+# Candidate station name columns in the boundary data, in order of preference
+STATION_COLUMNS = ['COMPNT_NM', 'STATION', 'NAME', 'Station_Na', 'STATION_N', 'station', 'name']
+SHAPEFILE_PARTS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+# Bump when the layout of cached geometry files changes
+GEOMETRY_CACHE_VERSION = 1
+
+
+def data_path(filename):
+    """Resolve a file in DATA_DIR, failing fast with a clear error if it is missing"""
+    path = os.path.join(DATA_DIR, filename)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"Data file not found: {path}. "
+            f"Set SA_CRIME_DATA_DIR to the directory containing {filename}."
+        )
+    return path
+
+
+def file_hash(path):
+    """Hash a shapefile together with its sidecar files"""
+    digest = hashlib.blake2b(digest_size=16)
+    stem = os.path.splitext(path)[0]
+    for ext in SHAPEFILE_PARTS:
+        part = stem + ext
+        if not os.path.exists(part):
+            continue
+        digest.update(ext.encode())
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_station_column(columns):
+    """Pick the column holding police station names"""
+    for col in STATION_COLUMNS:
+        if col in columns:
+            return col
+    # Fall back to any column that looks like it holds station names
+    for col in columns:
+        if any(keyword in col.lower() for keyword in ['station', 'name', 'compnt']):
+            return col
+    return None
+
+
+def geometry_cache_path(shp_path, station_col):
+    """Cache file for a shapefile, keyed on its contents and how it is read"""
+    stem = os.path.splitext(os.path.basename(shp_path))[0]
+    key = f"{GEOMETRY_CACHE_VERSION}|{file_hash(shp_path)}|{station_col}|{TARGET_CRS}"
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return os.path.join(CACHE_DIR, f"{stem}-{digest}.npz")
+
+
+def read_geometry_cache(cache_path, station_col):
+    """Rebuild a GeoDataFrame from cached station names and WKB"""
+    with np.load(cache_path, allow_pickle=False) as cached:
+        names = cached['names']
+        wkb = cached['wkb'].tobytes()
+        offsets = cached['offsets']
+    # Zero-length entries stand for missing geometries
+    geoms = [wkb[start:stop] or None for start, stop in zip(offsets[:-1], offsets[1:])]
+    geometry = gpd.GeoSeries.from_wkb(geoms, crs=TARGET_CRS)
+    return gpd.GeoDataFrame({station_col: names.astype(object)}, geometry=geometry, crs=TARGET_CRS)
+
+
+def write_geometry_cache(cache_path, gdf, station_col):
+    """Store station names and WKB geometries without pickling"""
+    wkbs = [wkb or b'' for wkb in gdf.geometry.to_wkb()]
+    offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(wkb) for wkb in wkbs])
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            names=gdf[station_col].astype(str).to_numpy(dtype=str),
+            wkb=np.frombuffer(b''.join(wkbs), dtype=np.uint8),
+            offsets=offsets,
+        )
+    os.replace(tmp_path, cache_path)
+
+
+def read_station_geometries(shp_path):
+    """Read station names and geometries in TARGET_CRS.
+
+    Only the station column and geometry are read, and the reprojected
+    result is cached as WKB keyed on the file hash, so later starts skip
+    both the shapefile parse and the reprojection. An unreadable cache
+    is ignored and rebuilt.
+    """
+    fields = list(pyogrio.read_info(shp_path)['fields'])
+    station_col = find_station_column(fields)
+    if station_col is None:
+        raise ValueError(f"No station name column found in {shp_path}. Available columns: {fields}")
+
+    cache_path = geometry_cache_path(shp_path, station_col)
+    if os.path.exists(cache_path):
+        try:
+            gdf = read_geometry_cache(cache_path, station_col)
+            print(f"Geometries loaded from cache: {cache_path}")
+            return gdf, station_col
+        except Exception as e:
+            print(f"Ignoring unreadable geometry cache {cache_path}: {e}")
+
+    gdf = pyogrio.read_dataframe(shp_path, columns=[station_col], use_arrow=HAS_ARROW)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(TARGET_CRS)
+    elif not gdf.crs.equals(TARGET_CRS):
+        gdf = gdf.to_crs(TARGET_CRS)
+
+    try:
+        write_geometry_cache(cache_path, gdf, station_col)
+    except OSError as e:
+        print(f"Could not write geometry cache: {e}")
+
+    return gdf, station_col
+
+
 class CrimeDataProcessor:
     def __init__(self):
         self.df = None
         self.gdf = None
+        self.station_col = None
+        self.points = None
+        self.points_station_col = None
         self.years = []
         self.processed_data = None
         self.df_WS_st = None
+        self.station_index = None
+        self.station_codes = None
+        self.region_sets = {}
         
     def load_data(self):
-        """Load and process crime data"""
+        """Load crime statistics and station boundaries"""
         try:
-            # Define the absolute path to your data directory
-            data_dir = r'..\data'
-            
-            # Load CSV data
-            csv_path = os.path.join(data_dir, 'SouthAfricaCrimeStats_v2.csv')
-            print(f"Looking for CSV at: {csv_path}")
-            
-            if not os.path.exists(csv_path):
-                print(f"CSV file not found at {csv_path}")
-                return False
-                
+            csv_path = data_path(CRIME_CSV)
+            print(f"Loading CSV from: {csv_path}")
             self.df = pd.read_csv(csv_path)
             print(f"CSV loaded successfully: {len(self.df)} records")
-            
-            # Load shapefile with improved error handling
-            shp_path = os.path.join(data_dir, 'Police_bounds.shp')
-            print(f"Looking for shapefile at: {shp_path}")
-            
-            if os.path.exists(shp_path):
-                try:
-                    # Try to read shapefile with different approaches
-                    print("Attempting to load shapefile...")
-                    
-                    # Method 1: Direct read
-                    try:
-                        self.gdf = gpd.read_file(shp_path)
-                        print("Shapefile loaded using direct method")
-                    except Exception as e1:
-                        print(f"Direct method failed: {e1}")
-                        
-                        # Method 2: Try with different drivers
-                        try:
-                            self.gdf = gpd.read_file(shp_path, driver='ESRI Shapefile')
-                            print("Shapefile loaded using ESRI Shapefile driver")
-                        except Exception as e2:
-                            print(f"ESRI driver failed: {e2}")
-                            
-                            # Method 3: Try reading with fiona directly
-                            try:
-                                import fiona
-                                with fiona.open(shp_path) as src:
-                                    features = [feature for feature in src]
-                                    crs = src.crs
-                                self.gdf = gpd.GeoDataFrame.from_features(features, crs=crs)
-                                print("Shapefile loaded using fiona method")
-                            except Exception as e3:
-                                print(f"Fiona method failed: {e3}")
-                                raise Exception("All shapefile loading methods failed")
-                    
-                    # Handle CRS if shapefile was loaded successfully
-                    if self.gdf is not None:
-                        # Handle CRS
-                        if self.gdf.crs is None:
-                            print("Setting default CRS to EPSG:4326")
-                            self.gdf = self.gdf.set_crs('EPSG:4326')
-                        else:
-                            print(f"Original CRS: {self.gdf.crs}")
-                            
-                        # Ensure we're in WGS84 for web mapping
-                        if str(self.gdf.crs) != 'EPSG:4326':
-                            try:
-                                self.gdf = self.gdf.to_crs('EPSG:4326')
-                                print("CRS converted to EPSG:4326")
-                            except Exception as crs_error:
-                                print(f"CRS conversion failed: {crs_error}")
-                                # Continue with original CRS
-                            
-                        print(f"Shapefile loaded successfully: {len(self.gdf)} features")
-                        print(f"Shapefile columns: {list(self.gdf.columns)}")
-                    
-                except Exception as shp_error:
-                    print(f"Error loading shapefile: {shp_error}")
-                    print("Continuing without shapefile - map functionality will be limited")
-                    self.gdf = None
-            else:
-                print(f"Shapefile not found at {shp_path}")
-                # Check for alternative shapefile names
-                shp_files = [f for f in os.listdir(data_dir) if f.endswith('.shp')]
-                if shp_files:
-                    print(f"Found other shapefiles: {shp_files}")
-                    print("You may need to update the shapefile name in the code")
-                print("Continuing without shapefile - map functionality will be limited")
-                self.gdf = None
-            
-            print(f"Data loaded successfully: {len(self.df)} records")
-            return True
-            
+        except FileNotFoundError as e:
+            print(e)
+            return False
         except Exception as e:
             print(f"Error loading data: {e}")
             import traceback
             traceback.print_exc()
             return False
-    
+
+        # Geometries are optional: the dashboard still works without the map
+        self.gdf, self.station_col = self.load_geometries(
+            BOUNDS_FILE, 'boundaries', 'map functionality will be limited')
+        points_consequence = ('region aggregation limited to method=area' if self.gdf is not None
+                              else 'region aggregation unavailable')
+        self.points, self.points_station_col = self.load_geometries(
+            POINTS_FILE, 'station points', points_consequence)
+
+        return True
+
+    def load_geometries(self, filename, label, consequence):
+        """Load station geometries from DATA_DIR, returning (None, None) if unavailable"""
+        try:
+            shp_path = data_path(filename)
+            print(f"Loading {label} from: {shp_path}")
+            gdf, station_col = read_station_geometries(shp_path)
+            print(f"{label.capitalize()} loaded successfully: {len(gdf)} features (station column: {station_col})")
+            return gdf, station_col
+        except (FileNotFoundError, ValueError) as e:
+            print(e)
+        except Exception as e:
+            print(f"Error loading {label}: {e}")
+        print(f"Continuing without {label} - {consequence}")
+        return None, None
+
     def process_crime_data(self):
         """Process crime data with severity weighting - from your Python script"""
         if self.df is None:
@@ -277,6 +367,10 @@ class CrimeDataProcessor:
             print(f"Weighted crime data created for {len(self.df_WS_st)} stations")
             self.processed_data = df_WS
             
+            # Integer station codes let region queries sum with bincount
+            self.station_codes, self.station_index = pd.factorize(df_WS['Station'], sort=True)
+            self.region_sets = {}
+            
         except Exception as e:
             print(f"Error creating weighted crime data: {e}")
             import traceback
@@ -289,30 +383,8 @@ class CrimeDataProcessor:
             return None
             
         try:
-            # Find station column in shapefile
-            station_cols = ['COMPNT_NM', 'STATION', 'NAME', 'Station_Na', 'STATION_N', 'station', 'name']
-            station_col = None
-            
-            print(f"Shapefile columns: {list(self.gdf.columns)}")
-            
-            for col in station_cols:
-                if col in self.gdf.columns:
-                    station_col = col
-                    break
-            
-            if station_col is None:
-                print("No matching station column found in shapefile")
-                print("Available columns:", list(self.gdf.columns))
-                # Try to find any column that might contain station names
-                for col in self.gdf.columns:
-                    if any(keyword in col.lower() for keyword in ['station', 'name', 'compnt']):
-                        station_col = col
-                        print(f"Trying column: {station_col}")
-                        break
-                
-                if station_col is None:
-                    return None
-                
+            station_col = self.station_col
+            
             print(f"Using station column: {station_col}")
             
             # Debug data before merge
@@ -473,6 +545,150 @@ class CrimeDataProcessor:
             print(f"Error getting province evolution: {e}")
             return {}, []
 
+    def register_regions(self, geojson, method=None, name_property=None):
+        """Assign police stations to user-supplied regions and memoize the result.
+
+        Stations are matched by point-in-polygon against Police_points, or
+        with method='area' by the share of each boundary polygon's area
+        that falls inside each region. Returns the region set id, a hash of
+        the region geometries, names and method.
+        """
+        if self.processed_data is None:
+            raise ValueError("Crime data has not been processed yet")
+        features = geojson.get('features') if isinstance(geojson, dict) else None
+        if not features:
+            raise ValueError("Expected a GeoJSON FeatureCollection with at least one feature")
+
+        if method is None:
+            method = 'points' if self.points is not None else 'area'
+        if method not in ('points', 'area'):
+            raise ValueError(f"Unknown method '{method}', expected 'points' or 'area'")
+        if method == 'points' and self.points is None:
+            raise ValueError("Station points are not loaded; use method=area")
+        if method == 'area' and self.gdf is None:
+            raise ValueError("Station boundaries are not loaded; use method=points")
+
+        try:
+            regions = gpd.GeoDataFrame.from_features(features, crs=TARGET_CRS)
+        except Exception as e:
+            raise ValueError(f"Invalid GeoJSON: {e}")
+        regions = regions[regions.geometry.notna() & ~regions.geometry.is_empty].reset_index(drop=True)
+        if regions.empty:
+            raise ValueError("No region has a usable geometry")
+        regions['geometry'] = regions.geometry.make_valid()
+        names = self.region_names(regions, name_property)
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(method.encode())
+        for name, wkb in zip(names, regions.geometry.to_wkb()):
+            digest.update(name.encode())
+            digest.update(wkb)
+        region_id = digest.hexdigest()
+        if region_id in self.region_sets:
+            return region_id
+
+        if method == 'points':
+            station_codes, region_idx, weights = self.assign_by_points(regions)
+        else:
+            station_codes, region_idx, weights = self.assign_by_area(regions)
+
+        if len(self.region_sets) >= REGION_CACHE_SIZE:
+            self.region_sets.pop(next(iter(self.region_sets)))
+        self.region_sets[region_id] = {
+            'names': names,
+            'method': method,
+            'station_codes': station_codes,
+            'region_idx': region_idx,
+            'weights': weights,
+        }
+        print(f"Registered region set {region_id}: {len(names)} regions, "
+              f"{len(np.unique(station_codes))} stations assigned by {method}")
+        return region_id
+
+    def region_names(self, regions, name_property=None):
+        """Pick a unique display name for each region"""
+        candidates = [name_property] if name_property else ['name', 'NAME', 'Name', 'id', 'ID']
+        for col in candidates:
+            if col in regions.columns:
+                names = regions[col].astype(str).tolist()
+                break
+        else:
+            if name_property:
+                raise ValueError(f"Region property '{name_property}' not found")
+            names = [f"Region {i + 1}" for i in range(len(regions))]
+        # Duplicate names would merge regions in the JSON response
+        seen = {}
+        for i, name in enumerate(names):
+            if name in seen:
+                seen[name] += 1
+                names[i] = f"{name} ({seen[name]})"
+            else:
+                seen[name] = 1
+        return names
+
+    def assign_by_points(self, regions):
+        """Match each station point to one region containing it.
+
+        A point on a boundary shared by several regions is assigned to the
+        first of them in upload order, so it is never counted twice.
+        """
+        points = self.points[[self.points_station_col, 'geometry']]
+        joined = gpd.sjoin(points, regions[['geometry']], how='inner', predicate='intersects')
+        joined = joined.sort_values('index_right', kind='stable')
+        joined = joined[~joined.index.duplicated(keep='first')]
+        station_codes = self.station_index.get_indexer(joined[self.points_station_col].astype(str).str.upper())
+        region_idx = joined['index_right'].to_numpy()
+        known = station_codes >= 0
+        return station_codes[known], region_idx[known], np.ones(known.sum())
+
+    def assign_by_area(self, regions):
+        """Weight each station by the share of its boundary inside each region"""
+        bounds = self.gdf.to_crs(EQUAL_AREA_CRS)
+        region_geoms = regions.to_crs(EQUAL_AREA_CRS).geometry
+        # Query the regions' STRtree with every station polygon at once
+        station_idx, region_idx = region_geoms.sindex.query(bounds.geometry, predicate='intersects')
+        station_geoms = bounds.geometry.iloc[station_idx].reset_index(drop=True)
+        overlap = station_geoms.intersection(region_geoms.iloc[region_idx].reset_index(drop=True)).area
+        station_area = station_geoms.area.to_numpy()
+        weights = np.divide(overlap.to_numpy(), station_area,
+                            out=np.zeros(len(station_area)), where=station_area > 0)
+        names = bounds[self.station_col].iloc[station_idx].astype(str).str.upper()
+        station_codes = self.station_index.get_indexer(names)
+        known = (station_codes >= 0) & (weights > 0)
+        return station_codes[known], region_idx[known], weights[known]
+
+    def get_region_summary(self, region_id, year=None, category=None):
+        """Get weighted crime totals per user-supplied region and year"""
+        if region_id not in self.region_sets:
+            raise KeyError(region_id)
+        region_set = self.region_sets[region_id]
+
+        if year and year in self.years:
+            year_cols = [year]
+        else:
+            year_cols = self.years
+
+        codes = self.station_codes
+        if category:
+            mask = (self.processed_data['Category'] == category).to_numpy()
+            if not mask.any():
+                raise ValueError(f"Unknown category '{category}'")
+            codes = codes[mask]
+        else:
+            mask = slice(None)
+
+        n_stations = len(self.station_index)
+        n_regions = len(region_set['names'])
+        summary = {name: {} for name in region_set['names']}
+        for year_col in year_cols:
+            values = self.processed_data[year_col].to_numpy()[mask]
+            station_totals = np.bincount(codes, weights=values, minlength=n_stations)
+            contributions = station_totals[region_set['station_codes']] * region_set['weights']
+            region_totals = np.bincount(region_set['region_idx'], weights=contributions, minlength=n_regions)
+            for name, total in zip(region_set['names'], region_totals):
+                summary[name][year_col] = float(total)
+        return summary
+
     def debug_data_merge(self):
         """Debug method to check data merging"""
         if self.gdf is None or self.df_WS_st is None:
@@ -481,18 +697,7 @@ class CrimeDataProcessor:
         
         print("\n=== DEBUGGING DATA MERGE ===")
         
-        # Check station column
-        station_cols = ['COMPNT_NM', 'STATION', 'NAME', 'Station_Na', 'STATION_N', 'station', 'name']
-        station_col = None
-        
-        for col in station_cols:
-            if col in self.gdf.columns:
-                station_col = col
-                break
-        
-        if station_col is None:
-            print("No station column found!")
-            return
+        station_col = self.station_col
         
         print(f"Using station column: {station_col}")
         
@@ -538,7 +743,7 @@ def index():
     try:
         if crime_processor.df is None:
             if not crime_processor.load_data():
-                return "Error loading data. Please check if the data files exist in C:\\Users\\John\\Desktop\\south_africa_crime_viz\\data", 500
+                return f"Error loading data. Please check if the data files exist in {DATA_DIR}", 500
             if not crime_processor.process_crime_data():
                 return "Error processing data", 500
         
@@ -647,6 +852,44 @@ def province_evolution_api():
         print(f"Error in province-evolution route: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/regions', methods=['POST'])
+def regions_api():
+    """API endpoint to upload a GeoJSON region set for aggregation"""
+    try:
+        geojson = request.get_json(silent=True)
+        region_id = crime_processor.register_regions(
+            geojson,
+            method=request.args.get('method'),
+            name_property=request.args.get('name'),
+        )
+        region_set = crime_processor.region_sets[region_id]
+        return jsonify({
+            'region_set': region_id,
+            'regions': region_set['names'],
+            'method': region_set['method'],
+            'stations_assigned': int(len(np.unique(region_set['station_codes']))),
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in regions route: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/region-data/<region_id>')
+@app.route('/api/region-data/<region_id>/<year>')
+def region_data_api(region_id, year=None):
+    """API endpoint for crime totals per uploaded region"""
+    try:
+        data = crime_processor.get_region_summary(region_id, year, request.args.get('category'))
+        return jsonify(data)
+    except KeyError:
+        return jsonify({"error": f"Unknown region set '{region_id}'", "details": "Upload regions to /api/regions first"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in region-data route: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/province-trends')
 def province_trends():
     """Province trends page with Nightingale Rose charts"""
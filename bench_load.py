@@ -0,0 +1,59 @@
+"""Benchmark boundary loading: the original read_file + to_crs path vs the cached ingest.
+
+Usage: python bench_load.py [shapefile] [repeats]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import geopandas as gpd
+
+import app
+
+
+def legacy_load(shp_path):
+    """The previous loader: read every attribute column, then reproject"""
+    gdf = gpd.read_file(shp_path)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(app.TARGET_CRS)
+    if str(gdf.crs) != app.TARGET_CRS:
+        gdf = gdf.to_crs(app.TARGET_CRS)
+    return gdf
+
+
+def best_of(func, repeats, setup=None):
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    shp_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(app.DATA_DIR, app.BOUNDS_FILE)
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    if not os.path.exists(shp_path):
+        sys.exit(f"Shapefile not found: {shp_path}")
+
+    app.CACHE_DIR = tempfile.mkdtemp(prefix='sa_crime_bench_')
+    clear_cache = lambda: shutil.rmtree(app.CACHE_DIR, ignore_errors=True)
+    try:
+        legacy = best_of(lambda: legacy_load(shp_path), repeats)
+        cold = best_of(lambda: app.read_station_geometries(shp_path), repeats, setup=clear_cache)
+        warm = best_of(lambda: app.read_station_geometries(shp_path), repeats)
+    finally:
+        clear_cache()
+
+    print(f"Shapefile: {shp_path} (best of {repeats})")
+    print(f"  legacy read_file + to_crs: {legacy * 1000:8.1f} ms")
+    print(f"  pruned read (cold cache):  {cold * 1000:8.1f} ms  ({legacy / cold:.1f}x)")
+    print(f"  WKB cache (warm):          {warm * 1000:8.1f} ms  ({legacy / warm:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()